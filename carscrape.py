@@ -4,29 +4,112 @@
 Scrape car data from autotrader.co.uk  
 
 Given CSV_FILE contains the list of cars to search for,
-Build a list of Advertisement objects and print a sample.
-Uses f-strings (assumes Python 3.7) 
+Scrape an Advertisement for every car found and write them to SCRAPED_ADS_FILE.
+Uses f-strings, asyncio and slotted dataclasses (assumes Python 3.10) 
 """
 
 
 #imports
-from selenium.webdriver import Firefox
-from selenium.webdriver.firefox.options import Options
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from playwright.async_api import async_playwright
+from playwright.async_api import Error as PlaywrightError
 
+import aiohttp
+import lxml.html
+
+import argparse
+import asyncio
 import csv
 import logging
+import math
+import os
+import re
+import shelve
+import sqlite3
+import time
+import itertools
 from collections import namedtuple
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlsplit
+from concurrent.futures import ProcessPoolExecutor
 
 
 #define constants
 BASE_URL = 'https://www.autotrader.co.uk'
-POSTCODE = 'PO16+7GZ'
+POSTCODE = 'PO16 7GZ'
 
 CSV_FILE = 'atuk_makes_and_models.csv'
 
+#query parameters shared by every search, make and model are added per search
+SEARCH_URL = f'{BASE_URL}/car-search?'
+SEARCH_PARAMS = {
+        'advertising-location' : 'at_cars',
+        'price-search-type' : 'total-price',
+        'search-target' : 'usedcars',
+        'postcode' : POSTCODE }
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:69.0) Gecko/20100101 Firefox/69.0'
+HTTP_TIMEOUT = 30
+
+#politeness limits for the ad page fan-out
+MAX_CONNECTIONS = 20
+MAX_CONNECTIONS_PER_HOST = 8
+MAX_CONCURRENT_ADS = 20
+
+#ads being fetched or parsed at once, which bounds the page HTML held in memory
+MAX_ADS_IN_PROGRESS = 2 * MAX_CONCURRENT_ADS
+
+#search page pool sizing, idle timeout is in seconds
+POOL_MIN = int(os.environ.get('POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('POOL_MAX', 3))
+POOL_IDLE = int(os.environ.get('POOL_IDLE', 300))
+
+#key specification icon names, mapped to the car_specs entry each one fills
+SPEC_ICONS = {
+        'ks-manufactured-year' : 'year',
+        'ks-body-type' : 'body_style',
+        'ks-mileage' : 'mileage',
+        'ks-engine-size' : 'engine_size',
+        'ks-transmission' : 'transmission',
+        'ks-fuel-type' : 'fuel_type',
+        'ks-doors' : 'doors' }
+
+#fetched ad pages and search results are reused for CACHE_TTL seconds
+PAGE_CACHE_FILE = 'ads.sqlite'
+SEARCH_CACHE_FILE = 'searches.shelf'
+CACHE_TTL = 3 * 24 * 60 * 60
+
+#page cache writes are committed this many at a time, not one fsync per ad
+PAGE_CACHE_BATCH = 100
+
+#every scraped ad is appended here as one CSV row, so a rerun can resume
+SCRAPED_ADS_FILE = 'ads.csv'
+
+#seconds to wait for a search page element to show up
+PAGE_WAIT = 20
+
+#search page selectors, dot-joined class names as on the ad pages
+RESULT_CARD = '.search-page__result'
+RESULTS_COUNT = '.search-form__count.js-results-count'
+NEXT_ARROW = '.pagination--right__active'
+
+#one round-trip returns every result id on the current search page
+RESULT_IDS_JS = 'cards => cards.map(card => card.id)'
+
+#true once the first result card is no longer the one we last saw
+PAGE_TURNED_JS = """
+firstId => {
+    const card = document.querySelector('.search-page__result');
+    return card !== null && card.id !== firstId;
+}
+"""
+
+#the search pages are only read, never looked at
+BLOCKED_RESOURCES = {'image', 'stylesheet', 'font', 'media'}
+
+#third-party analytics and ad scripts, never needed to render the results
+BLOCKED_HOSTS = re.compile(r'google-analytics|googletagmanager|doubleclick|hotjar|facebook')
+
 
 CarTup = namedtuple('CarTup', [
     'make',
@@ -34,114 +117,510 @@ CarTup = namedtuple('CarTup', [
     'total',])
 
 
-class Advertisement(object):
+@dataclass(slots=True)
+class Advertisement:
     """Class represents one used car advertisement
 
+    Slotted, so thousands of instances carry no per-instance __dict__.
+
     Attributes
     ----------
-    Most are self-explanatory str attributes of a car.
+    Most are self-explanatory str attributes of a car, 'Unknown' until set.
     hyperlink : str 
         the URL where the Advertisement was scraped.
 
     Methods
     -------
-    to_string() 
+    __str__() 
         Builds a string for output to the console, using all attributes.
     """
 
-    def __init__(self):
-        self.hyperlink = ''
-        self.description = ''
-        self.seller_type = ''
-        self.price = ''
+    hyperlink: str = 'Unknown'
+    description: str = 'Unknown'
+    seller_type: str = 'Unknown'
+    price: str = 'Unknown'
 
-        self.make = ''
-        self.model = ''
-        self.year = ''
-        self.mileage = ''
+    make: str = 'Unknown'
+    model: str = 'Unknown'
+    year: str = 'Unknown'
+    mileage: str = 'Unknown'
 
-        self.body_style = ''
-        self.co2emission = ''
-        self.doors = ''
-        self.transmission = ''
+    body_style: str = 'Unknown'
+    co2emission: str = 'Unknown'
+    doors: str = 'Unknown'
+    transmission: str = 'Unknown'
 
-        self.was_stolen = ''
-        self.was_write_off = ''
-        self.was_scrapped = ''
+    was_stolen: str = 'Unknown'
+    was_write_off: str = 'Unknown'
+    was_scrapped: str = 'Unknown'
 
-        self.engine_size = ''
-        self.fuel_type = ''
+    engine_size: str = 'Unknown'
+    fuel_type: str = 'Unknown'
 
 
-    def to_string(self):
+    def __str__(self):
         """Builds a string for output to the console, using all attributes."""
-        
-        return (f'Hyperlink: {self.hyperlink}, Description: {self.description}, ' \
-                f'Seller Type: {self.seller_type}, Price: {self.price}, ' \
-                f'Make: {self.make}, Model: {self.model}, Year: {self.year}, ' \
-                f'Mileage: {self.mileage}, Body Style: {self.body_style}, ' \
-                f'Co2 Emissions: {self.co2emission}, Doors: {self.doors}, ' \
-                f'Transmission: {self.transmission}, Was Stolen: {self.was_stolen}, ' \
-                f'Was Write Off: {self.was_write_off}, ' \
-                f'Was Scrapped: {self.was_scrapped}, Engine Size: {self.engine_size}, ' \
-                f'Fuel Type: {self.fuel_type}')
+
+        return ', '.join(f'{field.name}: {getattr(self, field.name)}' for field in fields(self))
+
+
+
+#column order for SCRAPED_ADS_FILE, 'scraped' dates each row so it can expire
+AD_FIELDS = [field.name for field in fields(Advertisement)] + ['scraped']
+
+
+
+class BrowserPool(object):
+    """Class represents a pool of reusable headless Chromium pages
+
+    One browser is started by start(); pages are opened lazily, up to
+    max_size, each in a fresh context of its own, and handed back out
+    instead of starting a browser for every search.  Cookies are cleared
+    whenever a page is released, so no search sees another's cookies.
+
+    Attributes
+    ----------
+    min_size : int
+        the reaper never shrinks the pool below this many pages.
+    max_size : int
+        the most pages that will ever be open at once.
+    idle_timeout : int
+        seconds a free page may sit unused before it is closed.
+
+    Methods
+    -------
+    start()
+        Launches the browser and starts the idle reaper.
+    acquire(timeout)
+        Returns an open page, waiting up to timeout seconds for one.
+        Calls start() first if the pool has not been started.
+    release(page)
+        Clears page's cookies and returns it to the pool.
+    close_all()
+        Stops the idle reaper and shuts the browser down.
+    """
+
+    def __init__(self, min_size=POOL_MIN, max_size=POOL_MAX, idle_timeout=POOL_IDLE):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._playwright = None
+        self._browser = None
+
+        #free pages are stored as (page, time released) tuples
+        self._free = None
+        self._size = 0
+        self._reaper = None
+        self._start_lock = asyncio.Lock()
+
+
+    async def start(self):
+        """Launches the browser and starts the idle reaper."""
+
+        self._playwright = await async_playwright().start()
+        self._browser = await open_browser(self._playwright)
+
+        self._free = asyncio.Queue()
+        self._reaper = asyncio.create_task(self._reap_idle())
+
+
+    async def acquire(self, timeout=None):
+        """Returns an open page, waiting up to timeout seconds for one."""
+
+        #the browser is only launched once a search actually needs it
+        async with self._start_lock:
+            if self._browser is None:
+                await self.start()
+
+        while True:
+            try:
+                page, _ = self._free.get_nowait()
+            except asyncio.QueueEmpty:
+                page = await self._grow()
+                if page is None:
+                    try:
+                        page, _ = await asyncio.wait_for(self._free.get(), timeout)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f'No page free after {timeout}s')
+
+            if not page.is_closed():
+                return page
+
+            logger.info(f'Discarding closed page ...')
+            self._size -= 1
+            await clean_up(page)
+
+
+    async def release(self, page):
+        """Clears page's cookies and returns it to the pool."""
+
+        try:
+            await page.context.clear_cookies()
+        except PlaywrightError as e:
+            #a page we cannot clean is not handed out again
+            logger.error(f'Error clearing cookies: {e}')
+            self._size -= 1
+            await clean_up(page)
+            return
+
+        self._free.put_nowait((page, time.monotonic()))
+
+
+    async def close_all(self):
+        """Stops the idle reaper and shuts the browser down."""
+
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+        #closing the browser closes every context and page, free or not
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+        self._playwright = None
+        self._browser = None
+        self._reaper = None
+        self._size = 0
+
+
+    async def _grow(self):
+        """Open a new page in its own context if the pool is below max_size, else None."""
+
+        if self._size >= self.max_size:
+            return None
+
+        #claim the slot before awaiting so concurrent callers see it
+        self._size += 1
+        try:
+            context = await self._browser.new_context(user_agent=USER_AGENT)
+        except PlaywrightError:
+            self._size -= 1
+            raise
+
+        try:
+            context.set_default_timeout(PAGE_WAIT * 1000)
+            await context.route('**/*', block_unneeded)
+            return await context.new_page()
+        except PlaywrightError:
+            self._size -= 1
+            await context.close()
+            raise
+
+
+    async def _reap_idle(self):
+        """Background task closing pages left idle for too long."""
+
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            expired = []
+
+            #no await in this pass, so acquire() cannot empty the queue under us
+            for _ in range(self._free.qsize()):
+                page, released = self._free.get_nowait()
+
+                if now - released > self.idle_timeout and self._size > self.min_size:
+                    expired.append(page)
+                    self._size -= 1
+                else:
+                    self._free.put_nowait((page, released))
+
+            for page in expired:
+                logger.info(f'Reaping idle page ...')
+                await clean_up(page)
+
+
+
+class PageCache(object):
+    """Class represents an SQLite cache of fetched page HTML, keyed by URL
+
+    Attributes
+    ----------
+    ttl : int
+        seconds a cached page stays fresh; older pages are deleted on open.
+    refresh : bool
+        when True nothing is read back, but fresh pages are still stored.
+
+    Writes are committed in batches of PAGE_CACHE_BATCH and on close().
+
+    Methods
+    -------
+    get(next_url)
+        Returns the cached HTML bytes for next_url, or None.
+    put(next_url, page_html)
+        Stores page_html for next_url.
+    delete(next_url)
+        Forgets any page stored for next_url.
+    close()
+        Commits and closes the database.
+    """
+
+    def __init__(self, path=PAGE_CACHE_FILE, ttl=CACHE_TTL, refresh=False):
+        self.ttl = ttl
+        self.refresh = refresh
+
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages '
+                '(url TEXT PRIMARY KEY, fetched REAL, html BLOB)')
+
+        #expired pages are never served again, so stop them piling up
+        self._db.execute('DELETE FROM pages WHERE fetched < ?', (time.time() - self.ttl,))
+        self._db.commit()
+
+        self._pending = 0
+
+
+    def get(self, next_url):
+        """Returns the cached HTML bytes for next_url, or None."""
+
+        if self.refresh:
+            return None
+
+        row = self._db.execute('SELECT html FROM pages WHERE url = ? AND fetched > ?',
+                (next_url, time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+
+    def put(self, next_url, page_html):
+        """Stores page_html for next_url."""
+
+        self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)',
+                (next_url, time.time(), page_html))
+        self._flush_every(PAGE_CACHE_BATCH)
+
+
+    def delete(self, next_url):
+        """Forgets any page stored for next_url."""
+
+        self._db.execute('DELETE FROM pages WHERE url = ?', (next_url,))
+        self._flush_every(PAGE_CACHE_BATCH)
+
+
+    def close(self):
+        """Commits and closes the database."""
+
+        self._db.commit()
+        self._db.close()
+
+
+    def _flush_every(self, batch_size):
+        """Commit once batch_size writes have built up since the last commit."""
+
+        self._pending += 1
+        if self._pending >= batch_size:
+            self._db.commit()
+            self._pending = 0
+
+
+
+class SearchCache(object):
+    """Class represents a shelve of search results, keyed by make and model
+
+    Attributes
+    ----------
+    ttl : int
+        seconds a cached search stays fresh.
+    refresh : bool
+        when True nothing is read back, but fresh results are still stored.
+
+    Methods
+    -------
+    get(next_car)
+        Returns the cached set of car id numbers for next_car, or None.
+    put(next_car, cars_found)
+        Stores the set cars_found for next_car.
+    close()
+        Closes the shelf.
+    """
+
+    def __init__(self, path=SEARCH_CACHE_FILE, ttl=CACHE_TTL, refresh=False):
+        self.ttl = ttl
+        self.refresh = refresh
+
+        self._shelf = shelve.open(path)
+
+
+    def get(self, next_car):
+        """Returns the cached set of car id numbers for next_car, or None."""
+
+        if self.refresh:
+            return None
+
+        cached = self._shelf.get(self._key(next_car))
+
+        if cached is None or time.time() - cached['searched'] > self.ttl:
+            return None
+        return cached['ids']
+
+
+    def put(self, next_car, cars_found):
+        """Stores the set cars_found for next_car."""
+
+        self._shelf[self._key(next_car)] = {
+                'searched' : time.time(),
+                'ids' : set(cars_found) }
+        self._shelf.sync()
+
+
+    def close(self):
+        """Closes the shelf."""
+
+        self._shelf.close()
+
+
+    def _key(self, next_car):
+        """Shelve keys must be strings."""
+
+        return f'{next_car.make}|{next_car.model}'
+
+
+
+class Fetcher(object):
+    """Class represents the HTTP client used for ad pages
+
+    Pages are served from the page cache when fresh. Otherwise they are
+    fetched with at most max_concurrent requests in flight, and a second
+    request for a URL already being fetched awaits the first one's result
+    instead of issuing a duplicate GET, and fetches it itself if the first
+    request is cancelled.
+
+    Methods
+    -------
+    get(next_url)
+        Returns the HTML bytes for next_url, or None if it could not be fetched.
+    discard(next_url)
+        Drops the cached copy of a page that turned out to be unusable.
+    """
+
+    def __init__(self, session, page_cache, max_concurrent=MAX_CONCURRENT_ADS):
+        self._session = session
+        self._page_cache = page_cache
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+        #URL -> Future resolving to the page bytes, for fetches in progress
+        self._inflight = {}
+
+
+    async def get(self, next_url):
+        """Returns the HTML bytes for next_url, or None if it could not be fetched."""
+
+        while next_url in self._inflight:
+            future = self._inflight[next_url]
+            try:
+                #shield so a cancelled waiter does not cancel the shared fetch
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                #only the fetch's owner was cancelled, so fetch it ourselves
+                if not future.cancelled():
+                    raise
+
+        page_html = self._page_cache.get(next_url)
+        if page_html is not None:
+            return page_html
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[next_url] = future
+
+        try:
+            async with self._semaphore:
+                page_html = await fetch_page(self._session, next_url)
+
+            if page_html is not None:
+                self._page_cache.put(next_url, page_html)
+
+            future.set_result(page_html)
+            return page_html
+
+        except Exception as e:
+            #hand the real error to any waiters, marked retrieved in case there are none
+            future.set_exception(e)
+            future.exception()
+            raise
+
+        except BaseException:
+            future.cancel()
+            raise
+
+        finally:
+            del self._inflight[next_url]
+
+
+    def discard(self, next_url):
+        """Drops the cached copy of a page that turned out to be unusable."""
+
+        self._page_cache.delete(next_url)
 
 #set up logging output
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+#every search borrows its page from here
+POOL = BrowserPool()
 
 
-def check_exists_by_tag(parent, next_tag):
-    """Return True if parent has a child of type next_tag."""
 
-    try:
-        parent.find_element_by_tag_name(next_tag)
-    except NoSuchElementException:
-        return False
-    return True
 
+async def open_browser(playwright):
+    """Launch and return a new (headless) Chromium browser."""
 
+    logger.info(f'Starting a new browser ...')
 
-def check_exists_by_class(parent, next_class):
-    """Return True if parent has a child of type next_class."""
+    return await playwright.chromium.launch(headless=True,
+            args=['--disable-extensions', '--blink-settings=imagesEnabled=false'])
 
-    try:
-        parent.find_element_by_class_name(next_class)
-    except NoSuchElementException:
-        return False
-    return True
 
 
+async def block_unneeded(route):
+    """Route handler aborting requests for resources and trackers we never need."""
 
+    if (route.request.resource_type in BLOCKED_RESOURCES
+            or BLOCKED_HOSTS.search(route.request.url)):
+        await route.abort()
+    else:
+        await route.continue_()
 
-def open_browser(next_url):
-    """Open next_url and returns a (headless) Firefox browser."""
 
-    logger.info(f'Opening page: {next_url} ...')
 
-    opts = Options()
-    opts.headless = True
-    browser = Firefox(options=opts)
+async def clean_up(page):
+    """Close a pooled page along with its context."""
 
+    logger.info(f'Closing a page ...')
     try:
-        browser.get(next_url)
-        return browser
-    except Exception as e:
-        logger.error(f'Error retrieving {next_url}: {e}')
-        return None
+        await page.context.close()
+    except PlaywrightError as e:
+        logger.error(f'Error closing {page}: {e}')
 
 
 
-def clean_up(browser):
-    """Close and quit the webdriver."""
 
-    logger.info(f'Closing the browser ...')
+def open_http_session():
+    """Return a new aiohttp session with the connection limits and headers we use."""
+
+    #the connector caps open sockets, callers cap requests in flight
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    headers = {'User-Agent': USER_AGENT}
+
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+
+
+
+
+async def fetch_page(session, next_url):
+    """Fetch next_url with the aiohttp session and return the raw HTML bytes."""
+
+    logger.info(f'Fetching page: {next_url} ...')
+
     try:
-        browser.close()
-        browser.quit()
-    except Exception as e:
-        logger.error(f'Error closing {browser}: {e}')
+        async with session.get(next_url) as response:
+            response.raise_for_status()
+            return await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f'Error retrieving {next_url}: {e}')
+        return None
 
 
 
@@ -150,220 +629,528 @@ def read_from_csv(next_csv):
     """
     Read first three columns of car data in from next_csv.
 
-    Return a list of CarTup namedtuples, cars_in
+    Generator, yields one CarTup namedtuple per row so the file is streamed
+    rather than held in memory. Yields nothing if next_csv cannot be opened.
     """
 
-    cars_in = []
-
     logger.info(f'Reading car data in from {next_csv} ...')
 
     try:
         with open(next_csv, newline='') as csv_file:
             csv_reader = csv.reader(csv_file)
             next(csv_reader) #skip the header line
-            cars_in = [CarTup._make(rec[0:3]) for rec in csv_reader]
-            return cars_in
+            yield from (CarTup._make(rec[0:3]) for rec in csv_reader)
 
     except IOError as e:
         logger.error(f'Could not open {next_csv}: {e}')
-        return None
 
 
 
 
-def search_all_car_types(these_cars):
+async def search_all_car_types(these_cars, search_cache):
     """
     Multi car-type wrapper for search_one_car_type.
 
+    Searches run concurrently, each borrowing a page from POOL.
     Return alphabetically ordered list (of sets of car id numbers)
     """
 
-    results_list = []
+    these_cars = list(these_cars)
 
-    for next_car in these_cars:
-        next_set = search_one_car_type(next_car)
+    #the pool starts on first use, so a fully cached search never opens a browser
+    try:
+        async with open_http_session() as session:
+            #gather keeps the results in the same order as these_cars
+            results = await asyncio.gather(*(search_one_car_type(next_car, session, search_cache)
+                    for next_car in these_cars))
+    finally:
+        await POOL.close_all()
 
-        #bundle together the make and model with the set of id numbers
-        quick_tuple = (next_car.make, next_car.model, next_set)
-        results_list.append(quick_tuple)
+    #bundle together the make and model with the set of id numbers
+    return [(next_car.make, next_car.model, next_set)
+            for next_car, next_set in zip(these_cars, results)]
 
-    return results_list
-        
 
 
 
-def search_one_car_type(next_car):
+async def search_one_car_type(next_car, session, search_cache):
     """
     Search BASE_URL for all cars of type next_car.
     
     Expects next_car to be a CarTup (make, model, total)
+    A fresh result in search_cache is returned without opening a page.
+    Further URL-paginated result pages are fetched with the aiohttp session.
     Return unordered set cars_found of URL id numbers
     """
 
     next_make = next_car.make
     next_model = next_car.model
     total_cars = int(next_car.total)
+
+    cars_found = search_cache.get(next_car)
+    if cars_found is not None:
+        logger.info(f'Using cached search for {next_make + " " + next_model}')
+        return cars_found
+
     cars_found = set()
 
     logger.info(f'Searching for {next_make + " " + next_model} ...')
 
-    search_url = f'{BASE_URL}/car-search?' \
-            f'advertising-location=at_cars&' \
-            f'price-search-type=total-price&' \
-            f'search-target=usedcars&' \
-            f'postcode={POSTCODE}&' \
-            f'make={next_make}&' \
-            f'model={next_model}&'
-
-    browser = open_browser(search_url)
-
-    #retrieve website value for total number of advertisements matching next_car
-    total_header = browser.find_element_by_class_name('search-form__count.js-results-count')
-    actual_total_string = total_header.text.split(' ')[0]
-    actual_total = int(actual_total_string)
-
-    #uncomment next line to use website's total rather than CSV expected total
-    #total_cars = actual_total
-
-    #loop through all possible pages of results
-    while True:
-        if browser is not None:
-            found_cars = browser.find_elements_by_class_name('search-page__result')
-            for car in found_cars:
-                cars_found.add(car.get_attribute('id'))
-        else:
-            logger.info(f'Got nothing back from {search_url}')
-        
-        #if we found all the expected cars, stop collecting ids
-        if len(cars_found) >= total_cars:
-            break
+    search_url = SEARCH_URL + urlencode({**SEARCH_PARAMS,
+            'make' : next_make,
+            'model' : next_model })
 
-        #otherwise, move to the next page of cars
-        logger.info(f'Added {len(cars_found)} so far.  Looking for {total_cars} ...')
-        next_arrow = browser.find_element_by_class_name('pagination--right__active')
-        browser.execute_script('arguments[0].click();', next_arrow)
+    page = await POOL.acquire()
+    logger.info(f'Opening page: {search_url} ...')
 
-        WebDriverWait(browser, 60).until(EC.staleness_of(next_arrow))
-    
+    searched = False
+
+    try:
+        #return as soon as the response starts, then wait only for what we read
+        await page.goto(search_url, wait_until='commit')
+
+        #retrieve website value for total number of advertisements matching next_car
+        total_header = await page.wait_for_selector(RESULTS_COUNT)
+        actual_total_string = (await total_header.inner_text()).split(' ')[0]
+        actual_total = int(actual_total_string)
+
+        #the CSV expected total decides how many ids to collect; the direct page
+        #fetch below also caps it at the website's total, as there are no pages
+        #past that.  Uncomment next line to use the website's total throughout
+        #total_cars = actual_total
+
+        #the first page always comes from the browser
+        await page.wait_for_selector(RESULT_CARD)
+        found_ids = await page.eval_on_selector_all(RESULT_CARD, RESULT_IDS_JS)
+        cars_found.update(found_ids)
+
+        #URL-paginated results can be fetched directly, otherwise click through
+        page_urls = await search_page_urls(page, len(found_ids), min(total_cars, actual_total))
+        if page_urls:
+            logger.info(f'Fetching {len(page_urls)} more pages of {next_make + " " + next_model} ...')
+            if not await fetch_result_pages(session, page_urls, cars_found):
+                logger.info('Direct page fetch incomplete, clicking through instead ...')
+                page_urls = []
+
+        #the page is still showing the first page of results
+        if not page_urls:
+            await click_through_pages(page, found_ids, cars_found, total_cars)
+
+        searched = True
+
+    except PlaywrightError as e:
+        logger.error(f'Error retrieving {search_url}: {e}')
 
-    clean_up(browser)
+    finally:
+        await POOL.release(page)
+
+    #only complete searches are worth keeping
+    if searched:
+        search_cache.put(next_car, cars_found)
 
     return cars_found
 
 
 
 
+async def search_page_urls(page, per_page, wanted):
+    """
+    Build the URLs of search result pages 2 onwards from the next arrow.
+
+    Return a list of URLs enough to hold wanted results at per_page a page,
+    or [] if the arrow is missing or does not link to a ?page=N URL.
+    """
+
+    next_arrow = await page.query_selector(NEXT_ARROW)
+    if next_arrow is None or per_page == 0:
+        return []
+
+    #the DOM property is the resolved absolute URL, the attribute may be relative
+    next_href = await next_arrow.evaluate("arrow => arrow.href || ''")
+    href_parts = urlsplit(next_href)
+    href_query = parse_qs(href_parts.query)
+    if 'page' not in href_query:
+        return []
+
+    total_pages = math.ceil(wanted / per_page)
+
+    return [href_parts._replace(query=urlencode({**href_query, 'page' : [str(page_number)]},
+                doseq=True)).geturl()
+            for page_number in range(2, total_pages + 1)]
+
+
 
 
-def scrape_all_cars(these_cars):
+async def click_through_pages(page, found_ids, cars_found, total_cars):
     """
-    Multi-car wrapper for scrape_one_car.
+    Fallback pagination, for when the next arrow has no ?page=N URL.
+
+    found_ids are the ids on the page currently shown. Click the next arrow
+    and add each page's ids to cars_found until total_cars have been found
+    or there are no pages left.
+    """
+
+    while len(cars_found) < total_cars:
+        logger.info(f'Added {len(cars_found)} so far.  Looking for {total_cars} ...')
+
+        #None (not an exception) means we are on the last page
+        next_arrow = await page.query_selector(NEXT_ARROW)
+        if next_arrow is None:
+            logger.info(f'Ran out of pages with {len(cars_found)} of {total_cars} found')
+            break
+
+        await next_arrow.evaluate('arrow => arrow.click()')
+
+        #survives a full navigation as well as an in-place re-render
+        await page.wait_for_function(PAGE_TURNED_JS, arg=found_ids[0], timeout=60000)
+
+        found_ids = await page.eval_on_selector_all(RESULT_CARD, RESULT_IDS_JS)
+        cars_found.update(found_ids)
+
+
+
+
+async def fetch_result_pages(session, page_urls, cars_found):
+    """
+    Fetch the search result pages page_urls directly and add their ids to cars_found.
+
+    Return False, leaving cars_found untouched, if any page failed or brought
+    no new ids: the results may be rendered client-side, a consent or bot
+    check page may have come back, or the server may have ignored the page
+    number.
+    """
+
+    pages_found = set(cars_found)
+
+    for page_html in await asyncio.gather(*(fetch_page(session, next_url)
+            for next_url in page_urls)):
+        if page_html is None:
+            return False
+
+        new_ids = parse_result_ids(page_html) - pages_found
+        if not new_ids:
+            return False
+        pages_found.update(new_ids)
+
+    cars_found.update(pages_found)
+    return True
+
+
+
+
+def parse_result_ids(page_html):
+    """Return the car id numbers of the result cards in one search page's HTML."""
+
+    tree = lxml.html.fromstring(page_html)
+    return {card.get('id') for card in tree.cssselect('.search-page__result')}
+
+
+
+
+
+
+async def scrape_all_cars(these_cars, page_cache, refresh=False, restart=False):
+    """
+    Multi-car wrapper for scrape_one_car_async.
     
     Expects these_cars to be an ordered list of tuples
     Each tuple should be (make, model, set(car id #s))
-    Return alphabetically ordered list of Advertisement objects 
+    Each new Advertisement is written to SCRAPED_ADS_FILE as it completes
+    and then dropped, so memory does not grow with the number of ads.
+    Ads already in that file and younger than CACHE_TTL are not scraped again,
+    unless refresh is True; the rows they replace are removed once all are
+    written. If restart is True the file is started afresh.
+    Return the number of new Advertisements written
     """
 
-    all_ads = []
-
     #break each type of car (make, model) out of these_cars
-    for each_tuple in these_cars:
-        next_make = each_tuple[0]
-        next_model = each_tuple[1]
-        car_set = each_tuple[2]
+    wanted_cars = {advert_url(next_car) : (next_car, next_make, next_model)
+            for next_make, next_model, car_set in these_cars
+            for next_car in car_set}
+
+    scraped_urls = set()
+    if not restart:
+        max_age = 0 if refresh else CACHE_TTL
+        scraped_urls = load_scraped_urls(SCRAPED_ADS_FILE, max_age)
+    if scraped_urls:
+        logger.info(f'Resuming, {len(scraped_urls)} ads already scraped')
+
+    new_file = restart or not os.path.exists(SCRAPED_ADS_FILE)
+    ads_written = 0
+
+    #fetching is IO-bound and stays on the loop, parsing is spread over every core
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        async with open_http_session() as session:
+            fetcher = Fetcher(session, page_cache)
+            in_progress = asyncio.Semaphore(MAX_ADS_IN_PROGRESS)
+
+            tasks = [scrape_one_car_async(fetcher, executor, in_progress,
+                        next_car, next_make, next_model)
+                    for next_url, (next_car, next_make, next_model) in wanted_cars.items()
+                    if next_url not in scraped_urls]
 
-        #scrape ads for all cars of this type
-        for next_car in car_set:
-            next_ad = scrape_one_car(next_car)
-            next_ad.make = next_make
-            next_ad.model = next_model
+            with open(SCRAPED_ADS_FILE, 'w' if new_file else 'a', newline='') as ads_file:
+                ads_writer = csv.DictWriter(ads_file, fieldnames=AD_FIELDS)
+                if new_file:
+                    ads_writer.writeheader()
 
-            all_ads.append(next_ad)
+                #record each ad the moment it is done, so a crash loses nothing
+                for next_task in asyncio.as_completed(tasks):
+                    next_ad = await next_task
+                    if next_ad is None:
+                        continue
 
-    return all_ads
+                    ads_writer.writerow({**asdict(next_ad),
+                            'scraped' : datetime.now().isoformat(timespec='seconds')})
+                    ads_file.flush()
+                    ads_written += 1
 
+    #old rows for the ads just scraped again can go now their new rows are safe
+    if ads_written and not new_file:
+        compact_scraped_ads(SCRAPED_ADS_FILE)
 
+    return ads_written
 
 
-def scrape_one_car(next_car):
+
+
+def load_scraped_urls(next_file, max_age):
+    """
+    Read the hyperlinks of the ads saved in next_file less than max_age seconds ago.
+
+    next_file is compacted first, see compact_scraped_ads.
+    Return a set of hyperlinks (empty if next_file is missing).
+    """
+
+    oldest = time.time() - max_age
+
+    return {hyperlink for hyperlink, scraped in compact_scraped_ads(next_file).items()
+            if scraped_since(scraped, oldest)}
+
+
+
+
+def compact_scraped_ads(next_file):
+    """
+    Rewrite next_file keeping only the newest row for each ad.
+
+    Complete rows are streamed through a temporary file which then replaces
+    next_file, dropping a row cut short by a crash. An older row is only
+    dropped once a later row for the same hyperlink has been written, so an
+    ad that fails to scrape again keeps the row it had.
+    Return a dict of {hyperlink : scraped time} for the rows kept
+    (empty if next_file is missing).
+    """
+
+    temp_file = next_file + '.tmp'
+
+    try:
+        cut_short = ends_mid_row(next_file)
+
+        #first pass finds the last row for each ad, the second keeps only those
+        latest = {}
+        with open(next_file, newline='') as old_file:
+            ads_reader = csv.DictReader(old_file)
+            for row_number, row in enumerate(read_complete_rows(ads_reader, next_file, cut_short)):
+                latest[row['hyperlink']] = row_number
+
+        kept = {}
+        with open(next_file, newline='') as old_file, \
+                open(temp_file, 'w', newline='') as new_file:
+            ads_reader = csv.DictReader(old_file)
+            ads_writer = csv.DictWriter(new_file, fieldnames=AD_FIELDS)
+            ads_writer.writeheader()
+
+            for row_number, row in enumerate(read_complete_rows(ads_reader, next_file, cut_short)):
+                if latest[row['hyperlink']] == row_number:
+                    kept[row['hyperlink']] = row['scraped']
+                    ads_writer.writerow(row)
+
+    except FileNotFoundError:
+        return {}
+
+    os.replace(temp_file, next_file)
+
+    return kept
+
+
+
+
+def ends_mid_row(next_file):
+    """Return True if next_file does not end with a line terminator."""
+
+    with open(next_file, 'rb') as raw_file:
+        if raw_file.seek(0, os.SEEK_END) == 0:
+            return False
+        raw_file.seek(-1, os.SEEK_END)
+        return raw_file.read(1) != b'\n'
+
+
+
+
+def read_complete_rows(ads_reader, next_file, cut_short):
+    """
+    Generator, yields the full-width rows of the csv.DictReader ads_reader.
+
+    If cut_short, the last row is an interrupted write and is not yielded,
+    even when the cut fell inside its last column and it looks complete.
+    """
+
+    #hold each row back one step, so the last one read can be dropped
+    previous = None
+
+    try:
+        for row in ads_reader:
+            if previous is not None:
+                yield previous
+                previous = None
+
+            #short rows are padded with None, long ones gain a None key
+            if None in row or None in row.values():
+                logger.info(f'Skipping a partial row in {next_file}')
+                continue
+
+            previous = row
+
+    except csv.Error as e:
+        #the row that failed to parse was the last one, not previous
+        logger.info(f'Skipping a partial row in {next_file}: {e}')
+        cut_short = False
+
+    if previous is None:
+        return
+
+    if cut_short:
+        logger.info(f'Skipping a partial row in {next_file}')
+    else:
+        yield previous
+
+
+
+
+def scraped_since(scraped, oldest):
+    """Return True if the ISO time scraped is after the epoch time oldest (False if undated)."""
+
+    try:
+        return datetime.fromisoformat(scraped or '').timestamp() > oldest
+    except ValueError:
+        return False
+
+
+
+
+def advert_url(next_car):
+    """Return the URL of the ad page for car id# next_car."""
+
+    return BASE_URL + '/classified/advert/' + next_car
+
+
+
+
+async def scrape_one_car_async(fetcher, executor, in_progress, next_car, next_make, next_model):
     """
     Scrape one car worth of data for next_car.
 
+    The page comes from fetcher and is parsed by a worker of executor.
+    The whole scrape holds a slot of the in_progress semaphore, so cached
+    pages cannot all be read and queued for parsing at once.
+
     Expects next_car to be a 15-digit string id# identifying a unique ad page.
     Example: '201910012835451'
+    Return an Advertisement object, or None if the page could not be fetched
+    or parsed.
+    """
+
+    next_url = advert_url(next_car)
+
+    async with in_progress:
+        page_html = await fetcher.get(next_url)
+        if page_html is None:
+            return None
+
+        logger.info(f'Scraping data for car# {next_car} ...')
+
+        #parsing is CPU work, hand it to another process (Advertisement pickles fine)
+        loop = asyncio.get_running_loop()
+        try:
+            next_ad = await loop.run_in_executor(executor, parse_ad, page_html, next_url)
+
+        #a removed ad or a bot check page lacks the elements parse_ad expects;
+        #skip it, and do not let the cache serve it again on the next run
+        except (IndexError, AttributeError) as e:
+            logger.error(f'Could not parse {next_url}: {e!r}')
+            fetcher.discard(next_url)
+            return None
+
+    next_ad.make = next_make
+    next_ad.model = next_model
+
+    return next_ad
+
+
+
+
+def parse_ad(page_html, next_url):
+    """
+    Parse the HTML of one ad page, fetched from next_url.
+
+    Pure function with no browser state, so it can run in a worker process.
+
     Return an Advertisement object.
     Default value for all Advertisement attributes is 'Unknown'.
     (Not all ad pages will contain all desired values)
     """
 
     next_ad = Advertisement()
-    next_url = BASE_URL + '/classified/advert/' + next_car
-
-    browser = open_browser(next_url)
-
-    logger.info(f'Scraping data for car# {next_car} ...')
+    tree = lxml.html.fromstring(page_html)
 
+    #class names below are dot-joined, so prefixing '.' gives a CSS selector
     description_class_name = 'advert-heading__title.atc-type-insignia.atc-type-insignia--medium'
-    next_description = browser.find_element_by_class_name(description_class_name).text
+    next_description = tree.cssselect('.' + description_class_name)[0].text_content().strip()
 
     price_class_name = 'advert-price__cash-price'
-    next_price = browser.find_element_by_class_name(price_class_name).text
+    next_price = tree.cssselect('.' + price_class_name)[0].text_content().strip()
 
     #seller paragraphs with anchor elements are dealers, othewise private owners.
     seller_class_name = 'seller-name.atc-type-toledo.atc-type-toledo--medium'
-    next_seller_para = browser.find_element_by_class_name(seller_class_name)
-    if check_exists_by_tag(next_seller_para, 'a'):
+    next_seller_para = tree.cssselect('.' + seller_class_name)[0]
+    if next_seller_para.cssselect('a'):
         next_seller = 'Dealer'
     else:
         next_seller = 'Private'
 
     #basic specs are in an unordered HTML list element
     specs_list_class_name = 'key-specifications'
-    car_specs = {
-            'year' : 'Unknown',
-            'body_style' : 'Unknown',
-            'mileage' : 'Unknown',
-            'engine_size' : 'Unknown',
-            'transmission' : 'Unknown',
-            'fuel_type' : 'Unknown',
-            'doors' : 'Unknown' }
-
-    if check_exists_by_class(browser, specs_list_class_name):
-        specs_list = browser.find_element_by_class_name(specs_list_class_name)
-        available_specs = specs_list.find_elements_by_tag_name('li')
+    car_specs = dict.fromkeys(SPEC_ICONS.values(), 'Unknown')
+
+    specs_lists = tree.cssselect('.' + specs_list_class_name)
+    if specs_lists:
+        available_specs = specs_lists[0].cssselect('li')
 
         #not all specs are always present, have to match by icon type
         for each_spec in available_specs:
             #the type of spec is buried in the second half of the icon's URL
-            spec_icon = each_spec.find_element_by_tag_name('use')
-            icon_link = spec_icon.get_attribute('xlink:href')
-            icon_type = icon_link.split('#')[1]
-
-            if icon_type == 'ks-manufactured-year':
-                car_specs['year'] = each_spec.text
-            if icon_type == 'ks-body-type':
-                car_specs['body_style'] = each_spec.text
-            if icon_type == 'ks-mileage':
-                car_specs['mileage'] = each_spec.text
-            if icon_type == 'ks-engine-size':
-                car_specs['engine_size'] = each_spec.text
-            if icon_type == 'ks-transmission':
-                car_specs['transmission'] = each_spec.text
-            if icon_type == 'ks-fuel-type':
-                car_specs['fuel_type'] = each_spec.text
-            if icon_type == 'ks-doors':
-                car_specs['doors'] = each_spec.text
+            #(the HTML parser keeps the prefixed attribute name as-is)
+            spec_icons = each_spec.cssselect('use')
+            if not spec_icons:
+                continue
+
+            icon_link = spec_icons[0].get('xlink:href') or ''
+            icon_type = icon_link.partition('#')[2]
+
+            spec_field = SPEC_ICONS.get(icon_type)
+            if spec_field is not None:
+                car_specs[spec_field] = each_spec.text_content().strip()
         
     #co2 emissions are the last item in a seperate "tech specs" table
     next_emission = 'Unknown'
     tech_specs_class_name = 'info-list.tech-specs__info-list'
 
-    if check_exists_by_class(browser, tech_specs_class_name):
-        tech_specs_table = browser.find_element_by_class_name(tech_specs_class_name)
-        tech_specs_items = tech_specs_table.find_elements_by_tag_name('li')
-        emissions_spans = tech_specs_items[-1].find_elements_by_tag_name('span')
-        #co2emissions value is considered HTML and not "text" ...
-        next_emission = emissions_spans[1].get_attribute('innerHTML') 
+    tech_specs_tables = tree.cssselect('.' + tech_specs_class_name)
+    if tech_specs_tables:
+        tech_specs_items = tech_specs_tables[0].cssselect('li')
+        emissions_spans = tech_specs_items[-1].cssselect('span')
+        next_emission = emissions_spans[1].text_content().strip()
 
     #get the Auto Trader vehicle check list
     next_was_stolen = 'Unknown'
@@ -372,20 +1159,20 @@ def scrape_one_car(next_car):
 
     vl_class_name = 'basic-check-m__check-list'
 
-    if check_exists_by_class(browser, vl_class_name):
-        vehicle_list = browser.find_element_by_class_name(vl_class_name)
-        vlist_items = vehicle_list.find_elements_by_tag_name('li')
+    vehicle_lists = tree.cssselect('.' + vl_class_name)
+    if vehicle_lists:
+        vlist_items = vehicle_lists[0].cssselect('li')
 
         #order in the HTML list element is: stolen, scrapped, write off
         #value will be "Clear" for a good result
-        both_spans = vlist_items[0].find_elements_by_tag_name('span')
-        next_was_stolen = both_spans[1].text
+        both_spans = vlist_items[0].cssselect('span')
+        next_was_stolen = both_spans[1].text_content().strip()
 
-        both_spans = vlist_items[1].find_elements_by_tag_name('span')
-        next_was_scrapped = both_spans[1].text
+        both_spans = vlist_items[1].cssselect('span')
+        next_was_scrapped = both_spans[1].text_content().strip()
 
-        both_spans = vlist_items[2].find_elements_by_tag_name('span')
-        next_was_write_off = both_spans[1].text
+        both_spans = vlist_items[2].cssselect('span')
+        next_was_write_off = both_spans[1].text_content().strip()
 
     #at this point we have everything, so build the Advertisement object
     next_ad.hyperlink = next_url
@@ -404,8 +1191,6 @@ def scrape_one_car(next_car):
     next_ad.engine_size = car_specs['engine_size']
     next_ad.fuel_type = car_specs['fuel_type']
 
-    clean_up(browser)
-
     return next_ad
 
 
@@ -413,17 +1198,35 @@ def scrape_one_car(next_car):
 
 def main():
 
+    parser = argparse.ArgumentParser(description='Scrape used car ads from autotrader.co.uk')
+    parser.add_argument('--no-cache', action='store_true',
+            help='ignore cached searches, ad pages and previously scraped ads '
+                '(fresh results are still cached, and ads.csv keeps other rows)')
+    parser.add_argument('--restart', action='store_true',
+            help='discard ads.csv and start it afresh')
+    args = parser.parse_args()
+
     #get requested car types
     cars_in = read_from_csv(CSV_FILE)
 
     #just a subset of the csv file ... to test
-    cars_found = search_all_car_types(cars_in[9:10]) 
+    search_cache = SearchCache(refresh=args.no_cache)
+    try:
+        cars_found = asyncio.run(search_all_car_types(itertools.islice(cars_in, 9, 10),
+                search_cache))
+    finally:
+        search_cache.close()
     
     #for all cars found, scrape data
-    ads_list = scrape_all_cars(cars_found)
+    page_cache = PageCache(refresh=args.no_cache)
+    try:
+        ads_written = asyncio.run(scrape_all_cars(cars_found, page_cache,
+                refresh=args.no_cache, restart=args.restart))
+    finally:
+        page_cache.close()
 
-    #output sample data
-    print(ads_list[1].to_string())
+    #output a summary, the ads themselves are in SCRAPED_ADS_FILE
+    print(f'Wrote {ads_written} new ads to {SCRAPED_ADS_FILE}')
 
 
 if __name__ == '__main__':